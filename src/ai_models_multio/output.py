@@ -7,20 +7,75 @@
 
 from __future__ import annotations
 
-import math
+import functools
+import logging
+import sys
+import threading
+import weakref
+from collections import deque
 from typing import TYPE_CHECKING
+from typing import Callable
 
-import multio
+import numpy as np
 from ai_models.model import Timer
 from ai_models.outputs import GribOutputBase
 
 if TYPE_CHECKING:
-    import numpy as np
+    import multio
     from earthkit.data.core.metadata import Metadata
+    from multio.plans import Client
 
 from .plans import PLANS
 from .plans import get_plan
 
+LOG = logging.getLogger(__name__)
+
+# Dtypes multio can write without converting
+_FIELD_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+
+def _any_nan_loop(values: np.ndarray) -> bool:
+    for value in values:
+        if np.isnan(value):
+            return True
+    return False
+
+
+def _any_nan_numpy(values: np.ndarray) -> bool:
+    return bool(np.isnan(values).any())
+
+
+@functools.lru_cache(maxsize=None)
+def _nan_scanner() -> Callable[[np.ndarray], bool]:
+    """Get the NaN scanning function, importing numba on first use"""
+    try:
+        from numba import njit
+    except ImportError:
+        return _any_nan_numpy
+    return njit(cache=True)(_any_nan_loop)
+
+
+def has_nans(data: np.ndarray) -> bool:
+    """Check if data contains any NaNs
+
+    Uses numba if available, to stop at the first NaN without
+    allocating a boolean array the size of the field.
+    """
+    return _nan_scanner()(data.ravel())
+
+
+def ensure_field(data: np.ndarray) -> np.ndarray:
+    """Get data as a C-contiguous array of a dtype multio can write directly
+
+    Returns data unchanged if it already is, otherwise a contiguous copy,
+    converted to float32 if not already float32 or float64.
+    """
+    if data.dtype in _FIELD_DTYPES:
+        if data.flags.c_contiguous:
+            return data
+        return np.ascontiguousarray(data)
+    return np.ascontiguousarray(data, dtype=np.float32)
+
 
 def geography_translate(metadata: Metadata) -> dict:
     """Translate geography metadata from earthkit to multio"""
@@ -39,9 +94,30 @@ def geography_translate(metadata: Metadata) -> dict:
     }
 
 
-def earthkit_to_multio(metadata: Metadata):
-    """Convert earthkit metadata to Multio metadata"""
+# Converted metadata, keyed on the earthkit metadata object it was converted from
+_METADATA_CACHE: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def earthkit_to_multio(metadata: Metadata) -> dict:
+    """Convert earthkit metadata to Multio metadata
+
+    The conversion is cached per metadata object, as templates are reused
+    for every step. A copy is returned, so it can be freely updated.
+    """
+    try:
+        cached = _METADATA_CACHE.get(metadata)
+    except TypeError:  # Not hashable or weak referenceable
+        return _earthkit_to_multio(metadata)
+
+    if cached is None:
+        cached = _METADATA_CACHE[metadata] = _earthkit_to_multio(metadata)
+    return cached.copy()
+
+
+def _earthkit_to_multio(metadata: Metadata) -> dict:
     metad = metadata.as_namespace("mars")
+    if not isinstance(metad, dict):
+        metad = dict(metad)
     metad.update(geography_translate(metadata))
     metad.pop("levtype", None)
     metad.pop("param", None)
@@ -53,11 +129,85 @@ def earthkit_to_multio(metadata: Metadata):
     return metad
 
 
+_MISSING = object()
+
+
+def _update_metadata(server_metadata: multio.Metadata, current: dict, metadata: dict) -> bool:
+    """Update server_metadata, holding `current`, to hold `metadata` by setting the keys which changed
+
+    Usually only the step changes between writes of the same field. `current` is updated to match.
+    Returns False if it cannot be updated in place, as keys were removed.
+    """
+    if not current.keys() <= metadata.keys():
+        return False
+
+    for key, value in metadata.items():
+        if current.get(key, _MISSING) != value:
+            server_metadata[key] = value
+            current[key] = value
+    return True
+
+
+class _ServerHolder:
+    """Holds the lazily created multio server
+
+    Kept apart from the output, so a finalizer can create or use the server without keeping the output alive.
+    """
+
+    def __init__(self):
+        self.server: multio.Multio | None = None
+        self.lock = threading.RLock()
+
+    def get(self, get_plan: Callable[[np.ndarray, dict], Client], data: np.ndarray, metadata: dict) -> multio.Multio:
+        """Get the server, creating it with the plan from `get_plan` on first use"""
+        if self.server is None:
+            import multio
+
+            with self.lock:
+                if self.server is None:
+                    with Timer("Multio server initialisation"):
+                        with multio.MultioPlan(get_plan(data, metadata)):
+                            self.server = multio.Multio()
+        return self.server
+
+
+class _StepContext:
+    """Context of a multio server, held open for the fields of a single step
+
+    Kept apart from the output, so a finalizer can exit it without keeping the output alive.
+    As `weakref.finalize` runs at interpreter exit by default, that also exits a context
+    still open then, such as when the output was never flushed.
+    """
+
+    def __init__(self):
+        # The value returned on entering the context, and the context manager itself
+        self.server: multio.Multio | None = None
+        self._manager: multio.Multio | None = None
+        self.step: int | None = None
+
+    def open(self, step: int, get_server: Callable[[], multio.Multio]) -> multio.Multio:
+        """Get the server with its context entered for `step`, exiting the context of any other step first"""
+        if self.step != step:
+            self.exit()
+            self.enter(get_server(), step)
+        return self.server
+
+    def enter(self, manager: multio.Multio, step: int):
+        self.server = manager.__enter__()
+        self._manager = manager
+        self.step = step
+
+    def exit(self, exc_type=None, exc_value=None, traceback=None):
+        if self._manager is None:
+            return
+        manager = self._manager
+        self.server = self._manager = self.step = None
+        manager.__exit__(exc_type, exc_value, traceback)
+
+
 class MultioOutput(GribOutputBase):
     """Multio Output plugin for ai-models"""
 
-    _server: multio.Multio = None
-
     def __init__(self, owner, path: str, metadata: dict, plan: PLANS = "to_file", **_):
         """Multio Output plugin for ai-models
 
@@ -69,49 +219,213 @@ class MultioOutput(GribOutputBase):
 
         self._plan_name = plan
 
+        self._server_holder = _ServerHolder()
+        self._server_lock = self._server_holder.lock
+        # The server context of the step being written, see `open`
+        self._context = _StepContext()
+        weakref.finalize(self, self._context.exit)
+
         metadata.setdefault("type", "fc")
         super().__init__(owner, path, metadata)
 
+        # Keys identical for every field written by this output
+        self._step_metadata = {
+            "trigger": "step",
+            "generatingProcessIdentifier": owner.version,
+        }
+        self._warned_conversion = False
+        # Server side metadata, with the dict it currently holds,
+        # keyed by (paramId, typeOfLevel, levelist), see `_write_field`
+        self._server_metadata: dict[tuple, tuple[multio.Metadata, dict]] = {}
+        # Whether multio.Metadata supports setting items, checked on the first write
+        self._reuse_metadata: bool | None = None
+
     def get_plan(self, data: np.ndarray, metadata: Metadata) -> multio.plans.Config:
         """Get the plan for the output"""
         return get_plan(self._plan_name, values=data, metadata=metadata, path=self.path)
 
     def server(self, data: np.ndarray, metadata: dict) -> multio.Multio:
         """Get multio server, with plan configured from data, metadata and path"""
-        if self._server is None:
-            with Timer("Multio server initialisation"):
-                with multio.MultioPlan(self.get_plan(data, metadata)):
-                    server = multio.Multio()
-                    self._server = server
-        return self._server
+        return self._server_holder.get(self.get_plan, data, metadata)
+
+    def open(self, data: np.ndarray, metadata: dict) -> multio.Multio:
+        """Get the multio server with its context entered for the step of `metadata`
+
+        The context is held open for all the fields of a step, rather than entered
+        and exited for every field, and is exited once a field of another step is written.
+        """
+        with self._server_lock:
+            return self._context.open(metadata["step"], lambda: self.server(data, metadata))
+
+    def close(self, exc_type=None, exc_value=None, traceback=None):
+        """Exit the multio server context, if open, passing on any exception raised while it was"""
+        with self._server_lock:
+            self._context.exit(exc_type, exc_value, traceback)
+
+    def flush(self):
+        """Write out the last step, by exiting the multio server context"""
+        self.close()
+
+    def template_metadata(self, template) -> dict:
+        """Get the multio metadata for a template field, merged with the grib keys
+
+        The conversion itself is cached by `earthkit_to_multio`, so this is a copy and an update.
+        """
+        metadata = earthkit_to_multio(template.metadata())
+        metadata.update(self.grib_keys)
+        return metadata
 
     def write(self, data: np.ndarray, *, check_nans: bool = False, **kwargs):
-        """Write data to multio"""
-        del check_nans  # Unused
+        """Write data to multio
 
+        Raises
+        ------
+        ValueError
+            If `check_nans` is set and the data contains NaNs
+        """
         # Skip if data is None
         if data is None:
             return
 
-        template_metadata: Metadata = kwargs.pop("template").metadata()
+        field = ensure_field(data)
+        if field is not data and not self._warned_conversion:
+            LOG.warning(
+                f"Converting data of dtype {data.dtype} with shape {data.shape} to a contiguous {field.dtype} array "
+                "before writing, pass a C-contiguous float32 or float64 array to avoid this copy."
+            )
+            self._warned_conversion = True
+        data = field
+
+        metadata_template = self.template_metadata(kwargs.pop("template"))
         step: int = kwargs.pop("step")
 
-        metadata_template = dict(earthkit_to_multio(template_metadata))
-        metadata_template.update(self.grib_keys)
         metadata_template.update(kwargs)
+        metadata_template.update(self._step_metadata)
+        metadata_template["step"] = step
+        metadata_template["globalSize"] = int(data.size)
+
+        if check_nans and has_nans(data):
+            raise ValueError(
+                f"NaNs found in field paramId={metadata_template['paramId']!r} "
+                f"levelist={metadata_template.get('levelist')!r} at step {step}"
+            )
 
-        metadata_template.update(
-            {
-                "step": step,
-                "trigger": "step",
-                "globalSize": math.prod(data.shape),
-                "generatingProcessIdentifier": self.owner.version,
-            }
+        self.write_field(data, metadata_template)
+
+    def write_field(self, data: np.ndarray, metadata: dict):
+        """Write a single field with its fully assembled metadata to the multio server"""
+        with self._server_lock:
+            server = self.open(data, metadata)
+            try:
+                self._write_field(server, data, metadata)
+            except BaseException:
+                self.close(*sys.exc_info())
+                raise
+
+    def _write_field(self, server: multio.Multio, data: np.ndarray, metadata: dict):
+        import multio
+
+        if self._reuse_metadata is None:
+            self._reuse_metadata = hasattr(multio.Metadata, "__setitem__")
+
+        if not self._reuse_metadata:
+            server.write_field(multio.Metadata(server, metadata), data)
+            return
+
+        key = (metadata["paramId"], metadata["typeOfLevel"], metadata.get("levelist"))
+        cached = self._server_metadata.get(key)
+
+        if cached is not None and _update_metadata(*cached, metadata):
+            server_metadata = cached[0]
+        else:
+            server_metadata = multio.Metadata(server, metadata)
+            self._server_metadata[key] = (server_metadata, dict(metadata))
+
+        server.write_field(server_metadata, data)
+        # server.notify(server_metadata)
+
+
+class BufferedMultioOutput(MultioOutput):
+    """Multio Output which queues fields and writes them a step at a time
+
+    Fields are held in memory until the step changes, or `flush` is called,
+    and are then all written to the server in one go. Unlike `MultioOutput`, which
+    holds the server context open from the first field of a step until the next step
+    begins, the context is only entered for the time it takes to write the queued step.
+    Data passed to `write` must therefore not be modified in place until it is flushed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._pending: deque[tuple[dict, np.ndarray]] = deque()
+        self._pending_step: int | None = None
+        weakref.finalize(
+            self,
+            _flush_pending,
+            self._pending,
+            self._context,
+            self._server_holder,
+            functools.partial(get_plan, self._plan_name, path=self.path),
         )
-        with self.server(data, metadata_template) as server:
-            server_metadata = multio.Metadata(server, metadata_template)
-            server.write_field(server_metadata, data)
-            # server.notify(server_metadata)
+
+    def write_field(self, data: np.ndarray, metadata: dict):
+        """Queue a field, flushing the queue first if it begins a new step"""
+        if metadata["step"] != self._pending_step:
+            self.flush()
+            self._pending_step = metadata["step"]
+        self._pending.append((metadata, data))
+
+    def flush(self):
+        """Write all queued fields to the multio server, and exit its context
+
+        Fields are dequeued as they are written, so if a write fails,
+        only that field and those after it remain queued.
+        """
+        with self._server_lock:
+            if self._pending:
+                metadata, data = self._pending[0]
+                server = self.open(data, metadata)
+                try:
+                    while self._pending:
+                        metadata, data = self._pending[0]
+                        self._write_field(server, data, metadata)
+                        self._pending.popleft()
+                except BaseException:
+                    self.close(*sys.exc_info())
+                    raise
+
+            super().flush()
+
+
+def _flush_pending(
+    pending: deque,
+    context: _StepContext,
+    server_holder: _ServerHolder,
+    get_plan: Callable[[np.ndarray, dict], Client],
+):
+    """Write fields still queued when a `BufferedMultioOutput` is collected, or at exit
+
+    Such as when a forecast fails before the output is flushed.
+    """
+    if not pending:
+        return
+
+    import multio
+
+    with server_holder.lock:
+        try:
+            metadata, data = pending[0]
+            server = context.open(metadata["step"], lambda: server_holder.get(get_plan, data, metadata))
+            while pending:
+                metadata, data = pending[0]
+                server.write_field(multio.Metadata(server, metadata), data)
+                pending.popleft()
+        except Exception:
+            LOG.exception(f"Failed to write {len(pending)} queued fields to multio, they have been discarded")
+            context.exit(*sys.exc_info())
+        else:
+            context.exit()
 
 
 class FDBMultioOutput(MultioOutput):
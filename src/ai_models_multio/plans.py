@@ -7,89 +7,140 @@
 
 from __future__ import annotations
 
+import functools
 import logging
 import os
 import warnings
 from pathlib import Path
 from typing import TYPE_CHECKING
+from typing import Callable
 from typing import Literal
 
-from multio.plans import Client
-from multio.plans import Plan
-from multio.plans import actions
-from multio.plans import sinks
-
 PLANS = Literal["to_file", "to_fdb", "debug"]
 
 if TYPE_CHECKING:
     import numpy as np
     from earthkit.data.core.metadata import Metadata
+    from multio.plans import Client
 
 LOG = logging.getLogger(__name__)
 
+_TEMPLATE_DIR = (Path(__file__).parent / "templates").absolute()
+# Template names, keyed by (ndim, levtype, edition)
+_TEMPLATE_NAMES: dict[tuple[int, str, int], str] = {
+    (1, "pl", 1): "regular_gg_pl_grib1",
+    (1, "pl", 2): "regular_gg_pl_grib2",
+    (1, "sfc", 1): "regular_gg_sfc_grib1",
+    (1, "sfc", 2): "regular_gg_sfc_grib2",
+    (2, "pl", 1): "regular_ll_pl_grib1",
+    (2, "pl", 2): "regular_ll_pl_grib2",
+    (2, "sfc", 1): "regular_ll_sfc_grib1",
+    (2, "sfc", 2): "regular_ll_sfc_grib2",
+}
+# Resolved template paths, keyed by template name
+_TEMPLATE_PATHS: dict[str, str] = {}
+
+# Configured plans for Multio Output, keyed by plan name
+_REGISTRY: dict[str, Callable[..., Client]] = {}
+
+
+def register_plan(name: str) -> Callable[[Callable[..., Client]], Callable[..., Client]]:
+    """Register a function building a plan, to be available from `get_plan` as `name`"""
+
+    def decorator(func: Callable[..., Client]) -> Callable[..., Client]:
+        _REGISTRY[name] = func
+        return func
+
+    return decorator
+
+
+@register_plan("to_file")
+@functools.lru_cache(maxsize=16)
+def _to_file(path: os.PathLike, template_path: os.PathLike, **_) -> Client:
+    from multio.plans import Plan
+    from multio.plans import actions
+    from multio.plans import sinks
+
+    return Plan(
+        actions=[
+            actions.Encode(
+                template=str(template_path),
+                format="grib",
+                addtional_metadata={"class": "ml"},
+            ),
+            actions.Sink(
+                sinks=[
+                    sinks.File(
+                        path=path,
+                        append=True,
+                        per_server=False,
+                    )
+                ]
+            ),
+        ],
+        name="output-to-file",
+    ).to_client()
+
+
+def _load_fdb_config(path: os.PathLike) -> dict:
+    """Load an FDB config"""
+    import yaml
+
+    with open(path) as f:
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+
+@register_plan("to_fdb")
+@functools.lru_cache(maxsize=16)
+def _to_fdb(path: os.PathLike, template_path: os.PathLike, **_) -> Client:
+    import yaml
+    from multio.plans import Plan
+    from multio.plans import actions
+    from multio.plans import sinks
+
+    try:
+        # Only loaded to check it is valid, once per plan as the plan is cached
+        _load_fdb_config(path)
+    except (OSError, ValueError, yaml.YAMLError):
+        LOG.warning(
+            f"'path' should point to an FDB config file.\nFailed to load FDB config from {path!r}, see {str(Path(__file__).parent.absolute()/'fdb'/'example_config.yaml')} for an example."
+        )
 
-class CONFIGURED_PLANS:
-    """Configured plans for Multio Output"""
-
-    @staticmethod
-    def to_file(path: os.PathLike, template_path: os.PathLike, **_) -> Client:
-        return Plan(
-            actions=[
-                actions.Encode(
-                    template=str(template_path),
-                    format="grib",
-                    addtional_metadata={"class": "ml"},
-                ),
-                actions.Sink(
-                    sinks=[
-                        sinks.File(
-                            path=path,
-                            append=True,
-                            per_server=False,
-                        )
-                    ]
-                ),
-            ],
-            name="output-to-file",
-        ).to_client()
-
-    @staticmethod
-    def to_fdb(path: os.PathLike, template_path: os.PathLike, **_) -> Client:
-
-        try:
-            import yaml
-
-            yaml.safe_load(open(path))
-        except (FileNotFoundError, ValueError):
-            LOG.warning(
-                f"'path' should point to an FDB config file.\nFailed to load FDB config from {path!r}, see {str(Path(__file__).parent.absolute()/'fdb'/'example_config.yaml')} for an example."
-            )
-
-        return Plan(
-            actions=[
-                actions.Encode(
-                    template=str(template_path),
-                    format="grib",
-                    addtional_metadata={"class": "ml"},
-                ),
-                actions.Sink(sinks=[sinks.FDB(config=str(path))]),
-            ],
-            name="output-to-fdb",
-        ).to_client()
-
-    @staticmethod
-    def debug(template_path: os.PathLike, **_) -> Client:
-        return Plan(
-            actions=[
-                actions.Print(stream="cout", prefix=" ++ MULTIO-DEBUG-PRIOR-ENCODE :: "),
-                actions.Encode(
-                    template=str(template_path),
-                    format="grib",
-                ),
-                actions.Print(stream="cout", prefix=" ++ MULTIO-DEBUG-POST-ENCODE :: "),
-            ],
-            name="debug",
-        ).to_client()
+    return Plan(
+        actions=[
+            actions.Encode(
+                template=str(template_path),
+                format="grib",
+                addtional_metadata={"class": "ml"},
+            ),
+            actions.Sink(sinks=[sinks.FDB(config=str(path))]),
+        ],
+        name="output-to-fdb",
+    ).to_client()
+
+
+@register_plan("debug")
+def _debug(template_path: os.PathLike, **_) -> Client:
+    # Only the template is used, so don't let other kwargs (such as the output path) split the cache
+    return _debug_plan(str(template_path))
+
+
+@functools.lru_cache(maxsize=16)
+def _debug_plan(template_path: str) -> Client:
+    from multio.plans import Plan
+    from multio.plans import actions
+
+    return Plan(
+        actions=[
+            actions.Print(stream="cout", prefix=" ++ MULTIO-DEBUG-PRIOR-ENCODE :: "),
+            actions.Encode(
+                template=str(template_path),
+                format="grib",
+            ),
+            actions.Print(stream="cout", prefix=" ++ MULTIO-DEBUG-POST-ENCODE :: "),
+        ],
+        name="debug",
+    ).to_client()
 
 
 def get_encode_params(values: np.ndarray, metadata: Metadata) -> dict:
@@ -103,6 +154,8 @@ def get_encode_params(values: np.ndarray, metadata: Metadata) -> dict:
         - $ECCODES_DIR/share/eccodes/samples
         and fails over to the default template
 
+    The resolved path is cached per template name, so the filesystem is only probed once for each.
+
     Returns
     -------
     dict
@@ -119,18 +172,34 @@ def get_encode_params(values: np.ndarray, metadata: Metadata) -> dict:
 
     edition = metadata.get("edition", 2)
 
-    if len(values.shape) == 1:
-        template_name = f"regular_gg_{levtype}_grib{edition}"
-    elif len(values.shape) == 2:
-        template_name = f"regular_ll_{levtype}_grib{edition}"
-    else:
-        warnings.warn(
-            f"Invalid shape {values.shape} for GRIB, must be 1 or 2 dimension ",
-            RuntimeWarning,
-        )
-        template_name = "default"
+    template_name = _TEMPLATE_NAMES.get((values.ndim, levtype, edition))
+    if template_name is None:
+        template_name = _template_name(values, levtype, edition)
+
+    return dict(template_path=_resolve_template(template_name))
 
-    template_path = (Path(__file__).parent / "templates" / (template_name + ".tmpl")).absolute()
+
+def _template_name(values: np.ndarray, levtype: str, edition: int) -> str:
+    """Get the template name for combinations not in `_TEMPLATE_NAMES`"""
+    if values.ndim == 1:
+        return f"regular_gg_{levtype}_grib{edition}"
+    elif values.ndim == 2:
+        return f"regular_ll_{levtype}_grib{edition}"
+
+    warnings.warn(
+        f"Invalid shape {values.shape} for GRIB, must be 1 or 2 dimension ",
+        RuntimeWarning,
+    )
+    return "default"
+
+
+def _resolve_template(template_name: str) -> str:
+    """Get the absolute path to a template, searching for it on the first call for each name"""
+    template_path = _TEMPLATE_PATHS.get(template_name)
+    if template_path is not None:
+        return template_path
+
+    template_path = _TEMPLATE_DIR / (template_name + ".tmpl")
 
     if not template_path.exists():
         if "MULTIO_RAPS_TEMPLATES_PATH" in os.environ:
@@ -145,11 +214,12 @@ def get_encode_params(values: np.ndarray, metadata: Metadata) -> dict:
                 f"Template {template_path} does not exist, using default template",
                 RuntimeWarning,
             )
-            template_path = Path(__file__).parent / "templates" / "default.tmpl"
+            template_path = _TEMPLATE_DIR / "default.tmpl"
 
     LOG.info(f"Using template {str(template_path)!r}")
 
-    return dict(template_path=(template_path.absolute()))
+    template_path = _TEMPLATE_PATHS[template_name] = str(template_path.absolute())
+    return template_path
 
 
 def get_plan(plan: PLANS, values: np.ndarray, metadata: Metadata, **kwargs) -> Client:
@@ -171,5 +241,10 @@ def get_plan(plan: PLANS, values: np.ndarray, metadata: Metadata, **kwargs) -> C
     Client
         Multio Plan configuration
     """
+    try:
+        plan_func = _REGISTRY[plan]
+    except KeyError:
+        raise ValueError(f"Unknown plan {plan!r}, must be one of {list(_REGISTRY)}") from None
+
     encoding_params = get_encode_params(values, metadata)
-    return getattr(CONFIGURED_PLANS, plan)(**encoding_params, **kwargs)
+    return plan_func(**encoding_params, **kwargs)
@@ -0,0 +1,377 @@
+import gc
+import sys
+import types
+from collections import defaultdict
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from ai_models_multio import output as multio_output
+from ai_models_multio.output import _METADATA_CACHE
+from ai_models_multio.output import BufferedMultioOutput
+from ai_models_multio.output import MultioOutput
+from ai_models_multio.output import earthkit_to_multio
+from ai_models_multio.output import ensure_field
+from ai_models_multio.output import has_nans
+
+
+class FakeMetadata:
+    """Stands in for earthkit metadata, counting the namespace lookups"""
+
+    def __init__(self, paramId=130, typeOfLevel="isobaricInhPa", levelist=500):
+        self.keys = {"paramId": paramId, "typeOfLevel": typeOfLevel}
+        self.mars = {"param": "t", "levtype": "pl", "levelist": levelist, "date": 20240101, "time": 0}
+        self.lookups = 0
+
+    def as_namespace(self, namespace):
+        self.lookups += 1
+        if namespace == "mars":
+            return dict(self.mars)
+        return defaultdict(int, gridType="regular_ll")
+
+    def __getitem__(self, key):
+        return self.keys[key]
+
+
+def test_earthkit_to_multio():
+    metadata = FakeMetadata()
+    converted = earthkit_to_multio(metadata)
+
+    assert converted["paramId"] == 130
+    assert converted["typeOfLevel"] == "isobaricInhPa"
+    assert converted["gridType"] == "regular_ll"
+    assert "param" not in converted
+    assert "levtype" not in converted
+
+
+def test_earthkit_to_multio_cached():
+    metadata = FakeMetadata()
+    first = earthkit_to_multio(metadata)
+    lookups = metadata.lookups
+
+    first["step"] = 6
+    second = earthkit_to_multio(metadata)
+
+    assert metadata.lookups == lookups
+    assert "step" not in second
+
+
+def test_earthkit_to_multio_cache_is_weak():
+    metadata = FakeMetadata()
+    earthkit_to_multio(metadata)
+    assert metadata in _METADATA_CACHE
+
+    size = len(_METADATA_CACHE)
+    del metadata
+    gc.collect()
+    assert len(_METADATA_CACHE) == size - 1
+
+
+class FakeServer:
+    """Stands in for a multio server, recording its context and the fields written to it"""
+
+    def __init__(self, fail=False):
+        self.entered = 0
+        self.exited = []
+        self.fields = []
+        self.fail = fail
+
+    def __enter__(self):
+        self.entered += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.exited.append(exc_type)
+
+    def write_field(self, metadata, data):
+        if self.fail:
+            raise RuntimeError("write failed")
+        self.fields.append((metadata.items["step"], metadata.items["paramId"]))
+
+
+class StubBufferedOutput(BufferedMultioOutput):
+    """Buffered output writing to a FakeServer, recording (step, paramId) of written fields"""
+
+    def __init__(self, fail_on=None, server=None):
+        super().__init__(MagicMock(), "output.grib", {})
+        self.fake_server = self._server_holder.server = server or FakeServer()
+        self.written = []
+        self.fail_on = fail_on
+
+    def _write_field(self, server, data, metadata):
+        field = (metadata["step"], metadata["paramId"])
+        if field == self.fail_on:
+            self.fail_on = None
+            raise RuntimeError("write failed")
+        self.written.append(field)
+
+
+def test_buffered_flush_on_step_change():
+    output = StubBufferedOutput()
+    output.write_field(None, {"step": 0, "paramId": 130})
+    output.write_field(None, {"step": 0, "paramId": 131})
+    assert output.written == []
+
+    output.write_field(None, {"step": 6, "paramId": 130})
+    assert output.written == [(0, 130), (0, 131)]
+    assert output.fake_server.entered == 1
+    assert output.fake_server.exited == [None]
+
+    output.flush()
+    assert output.written == [(0, 130), (0, 131), (6, 130)]
+    assert output.fake_server.entered == 2
+    assert output.fake_server.exited == [None, None]
+
+
+def test_buffered_flush_partial_failure():
+    output = StubBufferedOutput(fail_on=(0, 131))
+    for param in (130, 131, 132):
+        output.write_field(None, {"step": 0, "paramId": param})
+
+    with pytest.raises(RuntimeError):
+        output.flush()
+    assert output.written == [(0, 130)]
+    assert output.fake_server.exited == [RuntimeError]
+
+    # Fields already written are not written again
+    output.flush()
+    assert output.written == [(0, 130), (0, 131), (0, 132)]
+
+
+class StubContextOutput(MultioOutput):
+    """Output writing to a FakeServer, recording (step, paramId) of written fields"""
+
+    def __init__(self, fail_on=None):
+        super().__init__(MagicMock(), "output.grib", {})
+        self.fake_server = self._server_holder.server = FakeServer()
+        self.written = []
+        self.fail_on = fail_on
+
+    def _write_field(self, server, data, metadata):
+        field = (metadata["step"], metadata["paramId"])
+        if field == self.fail_on:
+            raise RuntimeError("write failed")
+        self.written.append(field)
+
+
+def test_context_held_for_step():
+    output = StubContextOutput()
+    output.write_field(None, {"step": 0, "paramId": 130})
+    output.write_field(None, {"step": 0, "paramId": 131})
+    assert output.written == [(0, 130), (0, 131)]
+    assert output.fake_server.entered == 1
+    assert output.fake_server.exited == []
+
+    output.write_field(None, {"step": 6, "paramId": 130})
+    assert output.fake_server.entered == 2
+    assert output.fake_server.exited == [None]
+
+    output.flush()
+    assert output.fake_server.exited == [None, None]
+
+
+def test_context_exited_with_exception():
+    output = StubContextOutput(fail_on=(0, 131))
+    output.write_field(None, {"step": 0, "paramId": 130})
+
+    with pytest.raises(RuntimeError):
+        output.write_field(None, {"step": 0, "paramId": 131})
+    assert output.fake_server.exited == [RuntimeError]
+
+    # The context is entered again for the next write
+    output.write_field(None, {"step": 0, "paramId": 132})
+    assert output.fake_server.entered == 2
+    assert output.written == [(0, 130), (0, 132)]
+
+
+def test_context_exited_when_collected():
+    output = StubContextOutput()
+    server = output.fake_server
+    output.write_field(None, {"step": 0, "paramId": 130})
+
+    del output
+    gc.collect()
+    assert server.exited == [None]
+
+
+def test_buffered_flushed_when_collected(fake_multio):
+    fake_multio(FakeMultioMetadata)
+    output = StubBufferedOutput()
+    server = output.fake_server
+    output.write_field(None, {"step": 0, "paramId": 130})
+    output.write_field(None, {"step": 0, "paramId": 131})
+
+    del output
+    gc.collect()
+    assert server.fields == [(0, 130), (0, 131)]
+    assert server.entered == 1
+    assert server.exited == [None]
+
+
+def test_buffered_flush_when_collected_fails(fake_multio, caplog):
+    fake_multio(FakeMultioMetadata)
+    server = FakeServer(fail=True)
+    output = StubBufferedOutput(server=server)
+    output.write_field(None, {"step": 0, "paramId": 130})
+
+    del output
+    gc.collect()
+    assert "Failed to write 1 queued fields" in caplog.text
+    assert server.exited == [RuntimeError]
+
+
+@pytest.fixture
+def numpy_nan_scan(monkeypatch):
+    """Use the numpy NaN scan, whether or not numba is installed"""
+    monkeypatch.setattr(multio_output, "_nan_scanner", lambda: multio_output._any_nan_numpy)
+
+
+@pytest.mark.parametrize("scan", [multio_output._any_nan_loop, multio_output._any_nan_numpy])
+def test_any_nan(scan):
+    assert scan(np.array([1.0, np.nan, 2.0]))
+    assert not scan(np.array([1.0, 2.0, 3.0]))
+
+
+def test_has_nans(numpy_nan_scan):
+    data = np.zeros((3, 4), dtype=np.float32)
+    assert not has_nans(data)
+
+    data[2, 1] = np.nan
+    assert has_nans(data)
+
+
+class FakeTemplate:
+    def __init__(self, metadata):
+        self._metadata = metadata
+
+    def metadata(self):
+        return self._metadata
+
+
+class StubOutput(MultioOutput):
+    """Output recording the fields it would write to multio"""
+
+    def __init__(self):
+        super().__init__(MagicMock(), "output.grib", {})
+        self.written = []
+
+    def write_field(self, data, metadata):
+        self.written.append((data, metadata))
+
+
+def test_write_check_nans(numpy_nan_scan):
+    output = StubOutput()
+    template = FakeTemplate(FakeMetadata())
+    data = np.zeros((3, 4), dtype=np.float32)
+
+    output.write(data, template=template, step=6, check_nans=True)
+    assert len(output.written) == 1
+
+    data[0, 0] = np.nan
+    with pytest.raises(ValueError):
+        output.write(data, template=template, step=12, check_nans=True)
+    assert len(output.written) == 1
+
+    # Not checked unless asked to
+    output.write(data, template=template, step=12)
+    assert len(output.written) == 2
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_ensure_field_unchanged(dtype):
+    data = np.zeros((3, 4), dtype=dtype)
+    assert ensure_field(data) is data
+
+
+def test_ensure_field_converts_dtype():
+    data = np.arange(12, dtype=np.float16).reshape(3, 4)
+    field = ensure_field(data)
+
+    assert field.dtype == np.float32
+    assert field.flags.c_contiguous
+    np.testing.assert_array_equal(field, data)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_ensure_field_copies_non_contiguous(dtype):
+    data = np.arange(12, dtype=dtype).reshape(3, 4).T
+    assert not data.flags.c_contiguous
+
+    field = ensure_field(data)
+    assert field is not data
+    assert field.dtype == dtype
+    assert field.flags.c_contiguous
+    np.testing.assert_array_equal(field, data)
+
+
+class FakeMultioMetadata:
+    """Stands in for multio.Metadata, counting how often it is built"""
+
+    built = 0
+
+    def __init__(self, server, metadata):
+        type(self).built += 1
+        self.items = dict(metadata)
+
+    def __setitem__(self, key, value):
+        self.items[key] = value
+
+
+class FakeReadOnlyMultioMetadata:
+    built = 0
+
+    def __init__(self, server, metadata):
+        type(self).built += 1
+        self.items = dict(metadata)
+
+
+class RecordingServer:
+    def __init__(self):
+        self.written = []
+
+    def write_field(self, metadata, data):
+        self.written.append(dict(metadata.items))
+
+
+@pytest.fixture
+def fake_multio(monkeypatch):
+    def install(metadata_class):
+        metadata_class.built = 0
+        monkeypatch.setitem(sys.modules, "multio", types.SimpleNamespace(Metadata=metadata_class))
+
+    return install
+
+
+def field_metadata(**keys):
+    return {"paramId": 130, "typeOfLevel": "isobaricInhPa", "levelist": 500, "step": 0, **keys}
+
+
+def test_server_metadata_reused(fake_multio):
+    fake_multio(FakeMultioMetadata)
+    output = MultioOutput(MagicMock(), "output.grib", {})
+    server = RecordingServer()
+
+    output._write_field(server, None, field_metadata(step=0, stepType="instant"))
+    output._write_field(server, None, field_metadata(step=6, stepType="accum", startStep=0))
+
+    assert FakeMultioMetadata.built == 1
+    assert server.written[1] == field_metadata(step=6, stepType="accum", startStep=0)
+
+    # Removing a key builds new metadata
+    output._write_field(server, None, field_metadata(step=12))
+    assert FakeMultioMetadata.built == 2
+    assert server.written[2] == field_metadata(step=12)
+
+
+def test_server_metadata_without_setitem(fake_multio):
+    fake_multio(FakeReadOnlyMultioMetadata)
+    output = MultioOutput(MagicMock(), "output.grib", {})
+    server = RecordingServer()
+
+    output._write_field(server, None, field_metadata(step=0))
+    output._write_field(server, None, field_metadata(step=6))
+
+    assert FakeReadOnlyMultioMetadata.built == 2
+    assert server.written[1] == field_metadata(step=6)
+    assert output._server_metadata == {}
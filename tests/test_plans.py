@@ -0,0 +1,143 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from ai_models_multio import plans
+
+
+@pytest.fixture
+def template_names(monkeypatch):
+    """Resolve templates to their name, without searching for them"""
+    monkeypatch.setattr(plans, "_resolve_template", lambda template_name: template_name)
+
+
+@pytest.mark.parametrize("key, template_name", plans._TEMPLATE_NAMES.items())
+def test_template_names(template_names, key, template_name):
+    ndim, levtype, edition = key
+    values = np.zeros((4,) * ndim)
+
+    params = plans.get_encode_params(values, {"levtype": levtype, "edition": edition})
+    assert params == {"template_path": template_name}
+
+
+def test_template_name_levtype_from_levelist(template_names):
+    values = np.zeros((4, 4))
+
+    assert plans.get_encode_params(values, {"levelist": 500})["template_path"] == "regular_ll_pl_grib2"
+    assert plans.get_encode_params(values, {})["template_path"] == "regular_ll_sfc_grib2"
+
+
+def test_template_name_fallback(template_names):
+    params = plans.get_encode_params(np.zeros((4, 4)), {"levtype": "ml", "edition": 2})
+    assert params["template_path"] == "regular_ll_ml_grib2"
+
+    params = plans.get_encode_params(np.zeros(4), {"levtype": "ml", "edition": 1})
+    assert params["template_path"] == "regular_gg_ml_grib1"
+
+
+def test_template_name_invalid_shape(template_names):
+    with pytest.warns(RuntimeWarning, match="Invalid shape"):
+        params = plans.get_encode_params(np.zeros((4, 4, 4)), {"levtype": "pl"})
+    assert params["template_path"] == "default"
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Register plans in an empty registry, leaving the configured plans untouched"""
+    monkeypatch.setattr(plans, "_REGISTRY", {})
+    return plans._REGISTRY
+
+
+def test_register_plan(registry, template_names):
+    @plans.register_plan("test")
+    def fake_plan(**kwargs):
+        return kwargs
+
+    assert registry == {"test": fake_plan}
+
+    plan = plans.get_plan("test", values=np.zeros((4, 4)), metadata={"levtype": "sfc"}, path="output.grib")
+    assert plan == {"template_path": "regular_ll_sfc_grib2", "path": "output.grib"}
+
+
+def test_configured_plans():
+    assert set(plans._REGISTRY) == {"to_file", "to_fdb", "debug"}
+
+
+def test_get_plan_unknown(registry):
+    with pytest.raises(ValueError, match="Unknown plan 'missing'"):
+        plans.get_plan("missing", values=np.zeros((4, 4)), metadata={})
+
+
+class FakePlan:
+    """Stands in for multio.plans.Plan"""
+
+    def __init__(self, actions, name):
+        self.actions = actions
+        self.name = name
+
+    def to_client(self):
+        return self
+
+
+def fake_component(**kwargs):
+    return kwargs
+
+
+@pytest.fixture
+def fake_multio_plans(monkeypatch):
+    """Stand in for multio.plans, which the plans import when built"""
+    multio_plans = types.SimpleNamespace(
+        Plan=FakePlan,
+        actions=types.SimpleNamespace(Encode=fake_component, Sink=fake_component, Print=fake_component),
+        sinks=types.SimpleNamespace(File=fake_component, FDB=fake_component),
+    )
+    monkeypatch.setitem(sys.modules, "multio", types.SimpleNamespace(plans=multio_plans))
+    monkeypatch.setitem(sys.modules, "multio.plans", multio_plans)
+
+
+def test_fdb_config_missing(fake_multio_plans, tmp_path, caplog):
+    plan = plans._to_fdb(str(tmp_path / "missing.yaml"), "template.tmpl")
+
+    assert "Failed to load FDB config" in caplog.text
+    assert plan.name == "output-to-fdb"
+
+
+def test_fdb_config_directory(fake_multio_plans, tmp_path, caplog):
+    plans._to_fdb(str(tmp_path), "template.tmpl")
+    assert "Failed to load FDB config" in caplog.text
+
+
+def test_fdb_config_invalid(fake_multio_plans, tmp_path, caplog):
+    path = tmp_path / "config.yaml"
+    path.write_text("type: [local\n")
+
+    plans._to_fdb(str(path), "template.tmpl")
+    assert "Failed to load FDB config" in caplog.text
+
+
+def test_fdb_config_valid(fake_multio_plans, tmp_path, caplog):
+    path = tmp_path / "config.yaml"
+    path.write_text("type: local\n")
+
+    plans._to_fdb(str(path), "template.tmpl")
+    assert "Failed to load FDB config" not in caplog.text
+
+
+def test_debug_plan_shared_across_paths(fake_multio_plans):
+    values = np.zeros((4, 4))
+    metadata = {"levtype": "sfc"}
+
+    first = plans.get_plan("debug", values=values, metadata=metadata, path="a")
+    assert plans.get_plan("debug", values=values, metadata=metadata, path="b") is first
+
+
+def test_file_plan_cached(fake_multio_plans, tmp_path):
+    values = np.zeros((4, 4))
+    metadata = {"levtype": "sfc"}
+    path = str(tmp_path / "output.grib")
+
+    first = plans.get_plan("to_file", values=values, metadata=metadata, path=path)
+    assert plans.get_plan("to_file", values=values, metadata=metadata, path=path) is first
+    assert plans.get_plan("to_file", values=values, metadata=metadata, path=path + ".2") is not first